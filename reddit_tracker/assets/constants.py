@@ -4,4 +4,11 @@ SUBREDDITS = ["singularity", "robotics"]
 
 WEEKLY_PLOT_FILE_PATH = "data/outputs/plots/timeseries_weekly_posts_by_humanoid.png"
 POST_SUMMARIES_TEMPLATE_FILE_PATH = "data/outputs/summaries/post_summaries_{}.json"
-REPORTS_TEMPLATE_FILE_PATH = "data/outputs/reports/report_{}.pdf"
\ No newline at end of file
+REPORTS_TEMPLATE_FILE_PATH = "data/outputs/reports/report_{}.pdf"
+OPENAI_CACHE_DIR = "data/staging/openai_cache"
+
+OPENAI_MAX_CONCURRENT_REQUESTS = 4  # Number of OpenAI requests in flight at once, sized to the rate limit tier
+COMMENTS_REPLACE_MORE_LIMIT = 32  # Number of "load more comments" expansions fetched per post
+COMMENTS_TOKEN_BUDGET = 12000  # Number of comment tokens sent to OpenAI per post
+CHARS_PER_TOKEN = 4  # Approximate number of characters per token, used to estimate the token count
+REDDIT_INFO_BATCH_SIZE = 100  # Number of posts fetched per request, the maximum allowed by Reddit
\ No newline at end of file
@@ -1,20 +1,83 @@
 # Standard library imports
-import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 # Third-party library imports
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-import duckdb
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
 
 # Local application/library imports
 from dagster import asset, AssetExecutionContext, MetadataValue, MaterializeResult
 from dagster_duckdb import DuckDBResource
 from . import constants
+from ..db import execute_with_retry
 from ..partitions import daily_partition
 
 
+# SQL query to upsert aggregated metrics for the weekly partition,
+# overwriting the previous weekly data in case of re-execution
+UPSERT_WEEKLY_METRICS_QUERY = """
+INSERT INTO weekly_post_metrics (id, humanoid, n_posts, avg_score, avg_comments, partition_date)
+SELECT
+    nextval('seq_weekly_id'),
+    humanoid,
+    COUNT(*) AS n_posts,
+    ROUND(AVG(score), 2) AS avg_score,
+    ROUND(AVG(n_comments), 2) AS avg_comments,
+    ? AS partition_date
+FROM posts
+WHERE created_utc >= ?
+AND created_utc < ?
+GROUP BY humanoid
+ON CONFLICT (humanoid, partition_date) DO UPDATE SET
+    n_posts = EXCLUDED.n_posts,
+    avg_score = EXCLUDED.avg_score,
+    avg_comments = EXCLUDED.avg_comments
+"""
+
+# SQL query to delete the weekly partition's metrics that the upsert would not overwrite - those of categories
+# without posts in the current window, left behind by a previous execution over a different window
+# (ie. a later day of the week), and those of unclassified posts, since their NULL key never conflicts
+DELETE_STALE_WEEKLY_METRICS_QUERY = """
+DELETE FROM weekly_post_metrics
+WHERE partition_date = ?
+AND (
+    humanoid IS NULL
+    OR NOT EXISTS (
+        SELECT 1
+        FROM posts
+        WHERE posts.humanoid = weekly_post_metrics.humanoid
+        AND created_utc >= ?
+        AND created_utc < ?
+    )
+)
+"""
+
+# SQL query to select the aggregated metrics after being inserted
+SELECT_WEEKLY_METRICS_QUERY = """
+SELECT humanoid, n_posts, avg_score, avg_comments
+FROM weekly_post_metrics
+WHERE partition_date = ?
+"""
+
+# SQL query to sum the weekly post counts of each humanoid category, expanding hyphenated
+# categories (ie. optimus-neo) to attribute a count to each relevant category
+# and ignoring 'none' and 'other'
+SELECT_WEEKLY_POST_COUNTS_QUERY = """
+SELECT partition_date, humanoid, SUM(n_posts) AS n_posts
+FROM (
+    SELECT partition_date, unnest(string_split(humanoid, '-')) AS humanoid, n_posts
+    FROM weekly_post_metrics
+)
+WHERE humanoid NOT IN ('none', 'other')
+GROUP BY partition_date, humanoid
+ORDER BY partition_date
+"""
+
+
 @asset(
     deps=['classify_daily_reddit_posts'],
     partitions_def=daily_partition,
@@ -30,110 +93,39 @@ def aggregate_posts_by_category_and_week(context: AssetExecutionContext, databas
     
     # Retrieve the partition date string and calculate the weekly date range starting on Monday (Monday = 0)
     partition_date_str = context.partition_key
-    partition_date = datetime.strptime(partition_date_str, '%Y-%m-%d')
+    partition_date = datetime.fromisoformat(partition_date_str).replace(tzinfo=timezone.utc)
     start_date = partition_date - timedelta(days=partition_date.weekday())
-    end_date = partition_date + timedelta(days=1)
     
-    # Convert start and end dates to UNIX timestamps
-    start_timestamp = int(time.mktime(start_date.timetuple()))
-    end_timestamp = int(time.mktime(end_date.timetuple()))
-    
-    # Convert timestamp to string to perform comparison with partition_date str in delete query
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    end_date_str = end_date.strftime('%Y-%m-%d')
+    # Convert start and end dates to UNIX timestamps in UTC
+    start_timestamp = int(start_date.timestamp())
+    end_timestamp = int(partition_date.timestamp()) + 86400
     
     # Convert to string to insert into the partition_date field of insert and select queries
     start_date_str = datetime.strftime(start_date, '%Y-%m-%d')
 
-    # SQL query to create a sequence for generating unique IDs
-    create_sequence_query = """  
-    CREATE SEQUENCE IF NOT EXISTS seq_weekly_id START 1;
-    """
-    
-    # SQL query to create the `weekly_post_metrics` table if it does not exist
-    create_query = """
-    CREATE TABLE IF NOT EXISTS weekly_post_metrics (
-        id INTEGER PRIMARY KEY,
-        humanoid TEXT,
-        n_posts INTEGER,
-        avg_score DOUBLE,
-        avg_comments DOUBLE,
-        partition_date VARCHAR(10)
-    )
-    """
+    # Open a single connection and retry only the individual statements on database IO errors
+    with database.get_connection() as conn:
+        # Execute SQL queries to delete the metrics the upsert would not overwrite, upsert data,
+        # and select that data to be used for dagster metadata
+        execute_with_retry(context, conn, DELETE_STALE_WEEKLY_METRICS_QUERY, [start_date_str, start_timestamp, end_timestamp])
+        execute_with_retry(context, conn, UPSERT_WEEKLY_METRICS_QUERY, [start_date_str, start_timestamp, end_timestamp])
+        aggregated_rows = execute_with_retry(context, conn, SELECT_WEEKLY_METRICS_QUERY, [start_date_str]).fetchall()
+        context.log.info("Query executed successfully.")
     
-    # SQL query to delete previous weekly data in case of re-execution    
-    delete_query = f"""  
-    DELETE FROM weekly_post_metrics
-    WHERE partition_date >= '{start_date_str}'
-    AND partition_date < '{end_date_str}';
-    """
-    
-    # SQL query to insert aggregated metrics for the weekly partition
-    insert_query = f"""
-    INSERT INTO weekly_post_metrics (id, humanoid, n_posts, avg_score, avg_comments, partition_date)
-    SELECT
-        nextval('seq_weekly_id'),
-        humanoid,
-        COUNT(*) AS n_posts,
-        ROUND(AVG(score), 2) AS avg_score,
-        ROUND(AVG(n_comments), 2) AS avg_comments,
-        '{start_date_str}' AS partition_date
-    FROM posts
-    WHERE created_utc >= '{start_timestamp}'
-    AND created_utc < '{end_timestamp}'
-    GROUP BY humanoid
-    """
-    
-    # SQL query to select the aggregated metrics after being inserted
-    select_query = f"""
-    SELECT humanoid, n_posts, avg_score, avg_comments
-    FROM weekly_post_metrics
-    WHERE partition_date = '{start_date_str}'
-    """
-    
-    # Retry logic for database operations
-    retries = 5
-    for attempt in range(retries):
-        try:
-            with database.get_connection() as conn:
-                # Execute SQL queries to create a sequence 
-                # in addition to create, delete, and insert data
-                # and select that data to be used for dagster metadata
-                conn.execute(create_sequence_query)
-                conn.execute(create_query)
-                conn.execute(delete_query)
-                conn.execute(insert_query)
-                aggregated_data = conn.execute(select_query).fetch_df()
-                context.log.info("Query executed successfully.")
-                break  # Exit loop if successful
-        except duckdb.IOException as e:
-            if attempt < retries - 1:
-                context.log.warning(f"Retrying due to error: {e}")
-                time.sleep(1)
-            else:
-                context.log.error("Retries exhausted. Raising error.")
-                raise
-        except Exception as e:
-            context.log.error(f"An unexpected error occurred: {e}")
-            raise
+    # Build the metadata of every humanoid category in a single pass over the aggregated rows
+    post_counts, avg_comment_counts, avg_post_scores = {}, {}, {}
+    for humanoid, n_posts, avg_score, avg_comments in aggregated_rows:
+        post_counts[f"Post count of {humanoid}"] = MetadataValue.int(int(n_posts))
+        avg_comment_counts[f"Avg comment count for {humanoid}"] = MetadataValue.float(float(avg_comments))
+        avg_post_scores[f"Avg post score for {humanoid}"] = MetadataValue.float(float(avg_score))
     
     # Return metadata
     return MaterializeResult(
         metadata={
-            "Total post count": MetadataValue.int(int(aggregated_data["n_posts"].sum())),
-            **{
-                f"Post count of {row['humanoid']}": MetadataValue.int(int(row["n_posts"]))
-                for _, row in aggregated_data.iterrows()
-            },
-            **{
-                f"Avg comment count for {row['humanoid']}": MetadataValue.float(row["avg_comments"])
-                for _, row in aggregated_data.iterrows()
-            },
-            **{
-                f"Avg post score for {row['humanoid']}": MetadataValue.float(row["avg_score"])
-                for _, row in aggregated_data.iterrows()
-            },
+            "Total post count": MetadataValue.int(sum(int(row[1]) for row in aggregated_rows)),
+            **post_counts,
+            **avg_comment_counts,
+            **avg_post_scores,
         }
     )
         
@@ -151,55 +143,22 @@ def plot_weekly_post_counts(context: AssetExecutionContext, database: DuckDBReso
 
     """
     
-    # SQL query to select all data from the `weekly_post_metrics` table
-    select_query = """SELECT * FROM weekly_post_metrics"""
-    
-    # Retres to handle database query failures
-    retries = 5
-    for attempt in range(retries):
-        try:
-            with database.get_connection() as conn:
-                # Query database and convert table to Pandas Dataframe
-                df = conn.execute(select_query).fetch_df()
-                context.log.info("Query executed successfully.")
-                break  # Exit loop if successful
-        except duckdb.IOException as e:
-            if attempt < retries - 1:
-                context.log.warning(f"Retrying due to error: {e}")
-                time.sleep(1)
-            else:
-                context.log.error("Retries exhausted. Raising error.")
-                raise
-        except Exception as e:
-            context.log.error(f"An unexpected error occurred: {e}")
-            raise
+    # Open a single connection and retry only the individual statements on database IO errors
+    with database.get_connection() as conn:
+        # Query database and convert table to Pandas Dataframe
+        df = execute_with_retry(context, conn, SELECT_WEEKLY_POST_COUNTS_QUERY).fetch_df()
+        context.log.info("Query executed successfully.")
 
     # Define the relevant humanoid categories
     categories = ["optimus", "figure", "neo"]
     
-    # Expand hyphenated categories into multiple rows to attribute a count to each relevant category
-    expanded_rows = []
-    for _, row in df.iterrows():
-        humanoids = row["humanoid"].split("-")  # Split hyphenated categories
-        for humanoid in humanoids:
-            if humanoid not in ['none', 'other']:  # Ignore 'none' and 'other'
-                new_row = row.copy()
-                new_row["humanoid"] = humanoid
-                expanded_rows.append(new_row)
-
-    # Convert the expanded rows into a new DataFrame
-    expanded_df = pd.DataFrame(expanded_rows)
-    
-    # Ensure partition_date is in datetime format and sort by date
-    expanded_df["partition_date"] = pd.to_datetime(expanded_df["partition_date"])
-    expanded_df = expanded_df.sort_values(by="partition_date")
-
-    # Group by week and humanoid, then sum post count
-    grouped = (
-        expanded_df.groupby(["partition_date", "humanoid"])["n_posts"]
-        .sum()
-        .unstack(fill_value=0)  # fills missing combinations of partition_date and humanoid to avoid NaN values in the pivoted table
-    )
+    # Ensure partition_date is in datetime format
+    df["partition_date"] = pd.to_datetime(df["partition_date"])
+
+    # Pivot the weekly post counts so each humanoid category is a column
+    grouped = df.pivot(
+        index="partition_date", columns="humanoid", values="n_posts"
+    ).fillna(0)  # fills missing combinations of partition_date and humanoid to avoid NaN values in the pivoted table
 
     # Reindex to ensure all categories are present
     grouped = grouped.reindex(columns=categories, fill_value=0)
@@ -207,8 +166,22 @@ def plot_weekly_post_counts(context: AssetExecutionContext, database: DuckDBReso
     # Reformat the date in the index to how it will display on x-axis
     grouped.index = grouped.index.strftime("%b-%d-%y") 
 
-    # Plotting
-    grouped.plot(kind="line", figsize=(10, 6), linewidth=2.5, marker="o", alpha=0.8)
+    # Plotting - draw every category's line as a single LineCollection and all markers with a single scatter
+    fig, ax = plt.subplots(figsize=(10, 6))
+    xs = np.arange(len(grouped))
+    colors = plt.rcParams["axes.prop_cycle"].by_key()["color"][:len(categories)]
+    segments = [np.column_stack([xs, grouped[category].to_numpy()]) for category in categories]
+    ax.add_collection(LineCollection(segments, linewidths=2.5, colors=colors, alpha=0.8))
+    ax.scatter(
+        np.tile(xs, len(categories)),
+        grouped[categories].to_numpy().T.ravel(),
+        c=[color for color in colors for _ in xs],  # Repeat each category's color for its points, whatever the color format
+        alpha=0.8,
+        zorder=3,
+    )
+    ax.autoscale_view()
+    ax.set_xticks(xs)
+    ax.set_xticklabels(grouped.index)
 
     # Customize y-axis ticks based on the maximum value in the data
     max_y = grouped.values.sum(axis=1).max()
@@ -221,8 +194,10 @@ def plot_weekly_post_counts(context: AssetExecutionContext, database: DuckDBReso
     plt.xlabel("Partition Date")
     plt.ylabel("Number of Posts")
     plt.title("Weekly Post Metrics by Humanoid Category")
-    plt.legend(title="Humanoid")
+    legend_handles = [Line2D([], [], color=color, linewidth=2.5, marker="o", alpha=0.8) for color in colors]
+    plt.legend(legend_handles, categories, title="Humanoid")
 
     # Adjust layout and save the plot to a file
     plt.tight_layout()
-    plt.savefig(constants.WEEKLY_PLOT_FILE_PATH)
\ No newline at end of file
+    plt.savefig(constants.WEEKLY_PLOT_FILE_PATH)
+    plt.close(fig)
\ No newline at end of file
@@ -1,5 +1,8 @@
 # Standard library imports
+import io
 import os
+import string
+from xml.sax.saxutils import escape
 from datetime import datetime
 
 # Third-party library imports
@@ -8,7 +11,7 @@ from reportlab.lib import colors
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from reportlab.platypus import Table, SimpleDocTemplate, Image, Paragraph, Spacer
+from reportlab.platypus import HRFlowable, SimpleDocTemplate, Image, Paragraph, Spacer
 
 # Dagster imports
 from dagster import asset, AssetExecutionContext, Config
@@ -17,6 +20,28 @@ from dagster import asset, AssetExecutionContext, Config
 from . import constants
 
 
+# Styles of the report, built once at import rather than on every report
+STYLES = getSampleStyleSheet()
+
+# Custom style for the centered date
+CENTERED_STYLE = ParagraphStyle(
+    name="Centered",
+    alignment=1,  # 1 means center alignment
+    fontSize=12,
+    textColor=colors.black,
+)
+
+# Template of the paragraph content of each summary
+SUMMARY_TEMPLATE = string.Template("""
+        Summary $idx of $n_summaries — $humanoid <br/> <br/>
+        <b>Title:</b> $title <br/> <br/>
+        <b>Summary:</b> <br/> <br/> $summary_text <br/> <br/>
+        <b>Themes:</b> <br/> <br/> $themes_formatted <br/> <br/>
+        <b>Post ID:</b> $post_id <br/>
+        <b>Total Comments:</b> $n_comments <br/>
+        <b>Post Permalink:</b> <a href="$post_permalink">$post_permalink</a> <br/> <br/>
+        """)
+
 
 class ReportConfig(Config):
     """
@@ -51,34 +76,28 @@ def generate_pdf_reports(context: AssetExecutionContext, config: ReportConfig) -
     
     # Initialize the PDF document template
     pdf = SimpleDocTemplate(output_path, pagesize=letter)
-    styles = getSampleStyleSheet()
     elements = []
 
     # Add a title to the PDF
-    title = Paragraph("Reddit Humanoid Report", styles['Title'])
+    title = Paragraph("Reddit Humanoid Report", STYLES['Title'])
     elements.append(title)
     
-    # Define a custom style for the centered date
-    centered_style = ParagraphStyle(
-    name="Centered",
-    alignment=1,  # 1 means center alignment
-    fontSize=12,
-    textColor=colors.black,
-    )
-    
     # Extract and format the date from the filename and add it below the title
     date_str = datetime.strptime(filename_no_ext.split("_")[-1], "%Y-%m-%d").strftime("%B %d, %Y")
-    date = Paragraph(date_str, centered_style)
+    date = Paragraph(date_str, CENTERED_STYLE)
     elements.append(date)
     elements.append(Spacer(1, 0.4 * inch))
 
     # Add a heading for the Plot section
-    elements.append(Paragraph("Weekly Post Plot:", styles['Heading2']))
+    elements.append(Paragraph("Weekly Post Plot:", STYLES['Heading2']))
     elements.append(Spacer(1, 0.25 * inch))
     
-    # Add the plot to the PDF
+    # Add the plot to the PDF, reading the image file once for both its size and its contents
     try:
-        with PILImage.open(plot_path) as img:
+        with open(plot_path, "rb") as f:
+            plot_data = f.read()
+        
+        with PILImage.open(io.BytesIO(plot_data)) as img:
             # Get the original width and height of the image
             width, height = img.size
             aspect_ratio = height / width
@@ -88,47 +107,50 @@ def generate_pdf_reports(context: AssetExecutionContext, config: ReportConfig) -
             img_height = img_width * aspect_ratio
             
             # Add the image to the PDF
-            elements.append(Image(plot_path, width=img_width, height=img_height))
+            elements.append(Image(io.BytesIO(plot_data), width=img_width, height=img_height))
             elements.append(Spacer(1, 0.4 * inch))
     except FileNotFoundError:
-        elements.append(Paragraph("Error: Plot image not found.", styles['Normal']))
+        elements.append(Paragraph("Error: Plot image not found.", STYLES['Normal']))
         elements.append(Spacer(1, 0.4 * inch))
     
     # Add a heading for the summaries section
-    elements.append(Paragraph("Post Summaries:", styles['Heading2']))
+    elements.append(Paragraph("Post Summaries:", STYLES['Heading2']))
     elements.append(Spacer(1, 0.25 * inch))
     
     # Add each summary to the PDF
     for idx, summary in enumerate(config.summaries):
-        # Extract fields from the summary, providing defaults if keys are missing
-        post_id = summary.get("post_id", "N/A")
-        post_permalink = summary.get("post_permalink", "N/A")
-        humanoid = summary.get("humanoid", "N/A")
-        title = summary.get("title", "N/A")
-        summary_text = summary.get("summary", "N/A")
+        # Extract fields from the summary, providing defaults if keys are missing, and escape the text
+        # from Reddit and OpenAI (ie. `&`, `<`, `>`) so it is not parsed as markup by ReportLab
+        post_id = escape(str(summary.get("post_id", "N/A")))
+        post_permalink = escape(str(summary.get("post_permalink", "N/A")), {'"': "&quot;"})
+        humanoid = escape(str(summary.get("humanoid", "N/A")))
+        title = escape(str(summary.get("title", "N/A")))
+        summary_text = escape(str(summary.get("summary", "N/A")))
         themes = summary.get("themes", [])
         n_comments = summary.get("n_comments", "N/A")
 
          # Format themes as a bulleted list with line breaks
-        themes_formatted = "<br/>".join([f"    • {theme}" for theme in themes])
+        themes_formatted = "<br/>".join(f"    • {escape(str(theme))}" for theme in themes)
         
         # Create the paragraph content for this summary
-        summary_paragraph = f"""
-        Summary {idx+1} of {len(config.summaries)} — {humanoid} <br/> <br/>
-        <b>Title:</b> {title} <br/> <br/>
-        <b>Summary:</b> <br/> <br/> {summary_text} <br/> <br/>
-        <b>Themes:</b> <br/> <br/> {themes_formatted} <br/> <br/>
-        <b>Post ID:</b> {post_id} <br/>
-        <b>Total Comments:</b> {n_comments} <br/>
-        <b>Post Permalink:</b> <a href="{post_permalink}">{post_permalink}</a> <br/> <br/>
-        """
+        summary_paragraph = SUMMARY_TEMPLATE.substitute(
+            idx=idx + 1,
+            n_summaries=len(config.summaries),
+            humanoid=humanoid,
+            title=title,
+            summary_text=summary_text,
+            themes_formatted=themes_formatted,
+            post_id=post_id,
+            n_comments=n_comments,
+            post_permalink=post_permalink,
+        )
         
         # Add the summary paragraph to the PDF
-        elements.append(Paragraph(summary_paragraph, styles['Normal']))
+        elements.append(Paragraph(summary_paragraph, STYLES['Normal']))
         elements.append(Spacer(1, 0.15 * inch))
         
         # Add a line separator between summaries
-        elements.append(Table([[Spacer(1, 1)]], style=[("LINEBELOW", (0, 0), (-1, -1), 0.5, colors.black)]))  # Line separator
+        elements.append(HRFlowable(width="100%", thickness=0.5, color=colors.black))  # Line separator
         elements.append(Spacer(1, 0.15 * inch))
         
     # Build the PDF
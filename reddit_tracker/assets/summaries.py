@@ -1,13 +1,15 @@
 # Standard library imports
 import os
 import time
-import json
-from datetime import datetime, timedelta
+import hashlib
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 # Third-party imports
+import orjson
 import prawcore
-import pandas as pd
-import duckdb
 
 # Dagster imports
 from dagster import asset, AssetExecutionContext, EnvVar
@@ -16,10 +18,73 @@ from dagster_openai import OpenAIResource
 
 # Local application imports
 from . import constants
+from ..db import execute_with_retry
 from ..resources.praw_resource import PRAWResource
 from ..partitions import daily_partition
 
 
+# SQL query to fetch the IDs and humanoid categories of the robot posts for the partitioned day
+SELECT_ROBOT_POSTS_QUERY = """
+SELECT post_id, humanoid
+FROM robot_posts
+WHERE created_utc >= ?
+AND created_utc < ?
+AND humanoid IN ('optimus', 'figure', 'neo');
+"""
+
+# Prompt for OpenAI to summarize Reddit posts
+SUMMARIZE_REDDIT_POST_PROMPT = '''
+    You are a marketer and product designer for a humanoid robotics company studying the public's perception of humanoid robots.
+    Briefly summarize the comments of the reddit post and list the major themes of people's perceptions of the humanoid robot
+    (ie. concerned about safety, the robot is too big, likes how the robot walks etc.).
+'''
+
+# JSON schema of the summaries returned by OpenAI, enforced with Structured Outputs
+REDDIT_SUMMARY_SCHEMA = {
+    "name": "RedditSummary",
+    "schema": {
+        "type": "object",
+        "properties": {
+            "summary": {"type": "string"},
+            "themes": {"type": "array", "items": {"type": "string"}},
+        },
+        "required": ["summary", "themes"],
+        "additionalProperties": False,
+    },
+    "strict": True,
+}
+
+
+def call_with_backoff(context: AssetExecutionContext, func, description, retries=5, delay=1):
+    """
+    Calls `func`, retrying Reddit server errors with an exponentially increasing delay.
+
+    Args:
+        context (AssetExecutionContext): Dagster context used for logging.
+        func (callable): Function taking no arguments to call.
+        description (str): What the call does, used in the log messages.
+        retries (int): Number of attempts before the error is raised.
+        delay (int): Delay in seconds before the first retry, doubled after each attempt.
+
+    Returns:
+        The return value of `func`.
+    """
+    
+    for attempt in range(retries):
+        try:
+            return func()
+        except prawcore.exceptions.ServerError as e:
+            context.log.warning(f"Server error while {description}: {e}")
+            if attempt < retries - 1:
+                time.sleep(delay * 2 ** attempt)
+            else:
+                context.log.error(f"Retries exhausted for {description}")
+                raise
+        except Exception as e:
+            context.log.error(f"An unexpected error occurred: {e}")
+            raise
+
+
 @asset(
     deps=['select_robot_posts'],
     partitions_def=daily_partition,
@@ -30,63 +95,21 @@ def summarize_robot_posts(context: AssetExecutionContext, database: DuckDBResour
     Summarizes Reddit posts about humanoid robots for a given day and extracts relevant themes.
     """
     
-    # Extract partition key (date string) and convert it to start and end datetime
+    # Extract partition key (date string) and convert it to the start and end Unix timestamps of its day in UTC for querying
     partition_date_str = context.partition_key
-    start_date = datetime.strptime(partition_date_str, "%Y-%m-%d")
-    end_date = start_date + timedelta(days=1)
+    start_timestamp = int(datetime.fromisoformat(partition_date_str).replace(tzinfo=timezone.utc).timestamp())
+    end_timestamp = start_timestamp + 86400
     
-    # Convert datetime to Unix timestamp for querying
-    start_timestamp = int(time.mktime(start_date.timetuple()))
-    end_timestamp = int(time.mktime(end_date.timetuple()))
+    # Open a single connection and retry only the individual statements on database IO errors
+    with database.get_connection() as conn:
+        # Fetch the result as an Arrow table rather than a Pandas Dataframe, reading its columns directly
+        partition_table = execute_with_retry(context, conn, SELECT_ROBOT_POSTS_QUERY, [start_timestamp, end_timestamp]).fetch_arrow_table()
+        context.log.info("Query executed successfully.")
     
-    # Query to fetch robot posts for the partitioned day
-    select_query = f"""
-        SELECT * 
-        FROM robot_posts
-        WHERE created_utc >= '{start_timestamp}'
-        AND created_utc < '{end_timestamp}'
-        AND humanoid IN ('optimus', 'figure', 'neo');
-    """
-    
-    retries = 5
-    for attempt in range(retries):
-        try:
-            with database.get_connection() as conn:
-                partition_df = conn.execute(select_query).fetch_df()
-                context.log.info("Query executed successfully.")
-                break  # Exit loop if successful
-        except duckdb.IOException as e:
-            if attempt < retries - 1:
-                context.log.warning(f"Retrying due to error: {e}")
-                time.sleep(1)
-            else:
-                context.log.error("Retries exhausted. Raising error.")
-                raise
-        except Exception as e:
-            context.log.error(f"An unexpected error occurred: {e}")
-            raise
-        
+    post_ids = partition_table.column("post_id").to_pylist()
+    humanoids = partition_table.column("humanoid").to_pylist()
     
     with openai.get_client(context) as client:
-        # Define a prompt for OpenAI to summarize Reddit posts
-        summarize_reddit_post_prompt = '''
-            You are a marketer and product designer for a humanoid robotics company interested in the public's 
-            perception of humanoid robots so that you may design your humanoid robot accordingly to meet
-            the needs of consumers.
-
-            Please provide a brief summary of the comments found within the reddit post,
-            and also list out major themes pertinent to people's perceptions of the humanoid 
-            robot that would be relevant to a marketer and product designer 
-            (ie. concerned about safety, the robot is too big, likes how the robot walks etc.).    
-
-            Return only a JSON object in the following format:
-
-            {
-                "summary": "summary text here",
-                "themes": ["theme 1", "theme 2", ..., "theme n"]
-            }
-        '''
-
         def summarize_reddit_post(comments_str):
             """
             Summarizes Reddit post comments and extracts themes using OpenAI GPT.
@@ -98,84 +121,154 @@ def summarize_robot_posts(context: AssetExecutionContext, database: DuckDBResour
                 dict: JSON object containing "summary" and "themes".
             """
             
+            model = "gpt-4o-mini"
+            temperature = 0  # Set low temperature to make output more deterministic
+            
+            # Return the cached response if the same request was already made, ie. when a partition is re-run.
+            # The key covers every request parameter, so changing the response schema never returns responses of the old shape
+            cache_key = hashlib.blake2b(b"\0".join([
+                model.encode(),
+                str(temperature).encode(),
+                orjson.dumps(REDDIT_SUMMARY_SCHEMA),
+                SUMMARIZE_REDDIT_POST_PROMPT.encode(),
+                comments_str.encode(),
+            ])).hexdigest()
+            cache_file = os.path.join(constants.OPENAI_CACHE_DIR, f"{cache_key}.json")
+            if os.path.exists(cache_file):
+                with open(cache_file, "r") as f:
+                    return f.read()
+            
             # Make an API call to OpenAI to classify sentiment
             response = client.chat.completions.create(
-                model="gpt-4o-mini",
+                model=model,
                 messages=[
                     {
                         "role": "system",
-                        "content": summarize_reddit_post_prompt
+                        "content": SUMMARIZE_REDDIT_POST_PROMPT
                     },
                     {
                         "role": "user",
                         "content": comments_str
                     }
                 ],
-                temperature=0,  # Set low temperature to make output more deterministic
+                temperature=temperature,
                 response_format={
-                    "type": "json_object"  # This is to enable JSON mode, making sure responses are valid json objects
+                    "type": "json_schema",  # This is to enable Structured Outputs, making sure responses match the schema
+                    "json_schema": REDDIT_SUMMARY_SCHEMA,
                 },
             )
+            content = response.choices[0].message.content
             
-            return response.choices[0].message.content
+            # Cache the response, writing it to a temporary file of its own first so a partial response
+            # is never read and concurrent requests with the same key (ie. posts without comments) don't collide
+            with tempfile.NamedTemporaryFile("w", dir=constants.OPENAI_CACHE_DIR, suffix=".tmp", delete=False) as f:
+                f.write(content)
+            os.replace(f.name, cache_file)
+            
+            return content
         
         
         # Initialize PRAW client for Reddit API
         reddit = praw.get_client()
         
-        # Initialize variables
-        retries = 5  # Number of retries
-        delay = 1  # Delay between retries in seconds
+        # Create the directory of the cached OpenAI responses
+        os.makedirs(constants.OPENAI_CACHE_DIR, exist_ok=True)
+        
+        def fetch_flattened_comments(post):
+            """
+            Fetches a Reddit post's comments and flattens them into a string.
+
+            Args:
+                post (praw.models.Submission): Reddit post fetched in the batched lookup.
+
+            Returns:
+                str: Flattened and concatenated Reddit comments.
+            """
+            
+            # Expand a bounded number of 'MoreComments' to fetch the post's comments,
+            # since expanding all of them fans out recursively for popular threads
+            call_with_backoff(
+                context,
+                lambda: post.comments.replace_more(limit=constants.COMMENTS_REPLACE_MORE_LIMIT),
+                f"fetching comments of post: {post.id}",
+            )
+            context.log.info(f"Fetched comments of post: {post.id}")
+
+            # Flatten the highest scoring comments into a string, stopping once the token budget of the
+            # prompt is exceeded (estimated from the number of characters per token)
+            max_chars = constants.COMMENTS_TOKEN_BUDGET * constants.CHARS_PER_TOKEN
+            n_chars = 0
+            flattened_comments = []
+            for comment in sorted(post.comments.list(), key=lambda comment: comment.score, reverse=True):
+                flattened_comment = f"- {comment.body} (Score: {comment.score}, Author: {comment.author.name if comment.author else '[deleted]'})"
+                n_chars += len(flattened_comment) + 1  # Account for the newline separator
+                if n_chars > max_chars:
+                    break
+                flattened_comments.append(flattened_comment)
+            return "\n".join(flattened_comments)
+        
+        # Fetch the posts by their fullnames in batches, rather than making a request per post
+        submissions = {}
+        for i in range(0, len(post_ids), constants.REDDIT_INFO_BATCH_SIZE):
+            fullnames = [f"t3_{post_id}" for post_id in post_ids[i:i + constants.REDDIT_INFO_BATCH_SIZE]]
+            batch = call_with_backoff(context, lambda: list(reddit.info(fullnames=fullnames)), f"fetching {len(fullnames)} posts")
+            submissions.update((post.id, post) for post in batch)
+        context.log.info(f"Fetched {len(submissions)} posts")
+        
+        # Pair the fetched posts with their humanoid categories, skipping the posts
+        # that could no longer be fetched from Reddit (ie. removed posts)
+        posts, post_humanoids = [], []
+        for post_id, humanoid in zip(post_ids, humanoids):
+            if post_id in submissions:
+                posts.append(submissions[post_id])
+                post_humanoids.append(humanoid)
+            else:
+                context.log.warning(f"Skipping post that could not be fetched: {post_id}")
         
         # Check if there are posts to process
-        if len(partition_df) > 0:
-            all_summaries = []    
-            for _, row in partition_df.iterrows():
-                for attempt in range(retries):
-                    try:
-                        # Fetch the post by ID
-                        post = reddit.submission(id=row.post_id)
-                        context.log.info(f"Fetched post: {row.post_id}")
-                        break
-                    except prawcore.exceptions.ServerError as e:
-                        context.log.warning(f"Server error while fetching post: {row.post_id}: {e}")
-                        if attempt < retries - 1:
-                            time.sleep(delay)
-                        else:
-                            context.log.error(f"Retries exhausted for post: {row.post_id}")
-                            raise
-                    except Exception as e:
-                        context.log.error(f"An unexpected error occurred: {e}")
-                        raise
-                
-                 # Expand 'MoreComments' and fetch all comments
-                post.comments.replace_more(limit=None)
-
-                # Flatten the comments into a string
-                flattened_comments = [
-                    f"- {comment.body} (Score: {comment.score}, Author: {str(comment.author) if comment.author else '[deleted]'})"
-                    for comment in post.comments.list()
-                ]
-                flattened_comments_str = "\n".join(flattened_comments)
+        if len(posts) > 0:
+            output_file = constants.POST_SUMMARIES_TEMPLATE_FILE_PATH.format(partition_date_str)
+            temp_output_file = f"{output_file}.tmp"  # Written first so the sensor never reads a partial JSON file
+            n_summaries = 0
+            
+            def write_summary(f, post, humanoid, summary_future):
+                """
+                Waits for a post's summary and appends it, with the post's metadata, to the JSON array.
+                """
                 
-                # Summarize comments and extract themes
-                summary_json_str = summarize_reddit_post(flattened_comments_str)
-                summary_dict = json.loads(summary_json_str)
+                nonlocal n_summaries
                 
                 # Add metadata to the summary
                 summary_with_metadata = {
                     "post_id": post.id,
                     "n_comments": post.num_comments,
                     "post_permalink": post.permalink,
-                    "humanoid": row.humanoid,
+                    "humanoid": humanoid,
                     "title": post.title,
-                    **summary_dict,
+                    **orjson.loads(summary_future.result()),
                 }
-                all_summaries.append(summary_with_metadata)
-
-            # Save the data to a JSON file
-            output_file = constants.POST_SUMMARIES_TEMPLATE_FILE_PATH.format(partition_date_str)
-            with open(output_file, "w") as f:
-                json.dump(all_summaries, f, indent=4)  # indentation of 4 spaces for each nested level
+                if n_summaries > 0:
+                    f.write(b",\n")
+                f.write(orjson.dumps(summary_with_metadata, option=orjson.OPT_INDENT_2))  # indentation of 2 spaces for each nested level
+                n_summaries += 1
+            
+            # Fetch the comments of the posts one at a time, since the Reddit client is not thread-safe, while their
+            # summaries are requested from OpenAI concurrently. At most `OPENAI_MAX_CONCURRENT_REQUESTS` summaries are
+            # in flight, and the oldest is written to the JSON array before the next post's comments are fetched,
+            # so the summaries are streamed in the order of the queried posts with bounded memory
+            pending_summaries = deque()
+            with ThreadPoolExecutor(max_workers=constants.OPENAI_MAX_CONCURRENT_REQUESTS) as executor, open(temp_output_file, "wb") as f:
+                f.write(b"[\n")
+                for post, humanoid in zip(posts, post_humanoids):
+                    if len(pending_summaries) == constants.OPENAI_MAX_CONCURRENT_REQUESTS:
+                        write_summary(f, *pending_summaries.popleft())
+                    summary_future = executor.submit(summarize_reddit_post, fetch_flattened_comments(post))
+                    pending_summaries.append((post, humanoid, summary_future))
+                while pending_summaries:
+                    write_summary(f, *pending_summaries.popleft())
+                f.write(b"\n]")
+            
+            # Move the complete JSON file into place
+            os.replace(temp_output_file, output_file)
 
-            context.log.info(f"Saved {len(all_summaries)} posts to {output_file}")
\ No newline at end of file
+            context.log.info(f"Saved {n_summaries} posts to {output_file}")
\ No newline at end of file
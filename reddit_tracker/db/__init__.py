@@ -0,0 +1,36 @@
+import time
+
+import duckdb
+from dagster import AssetExecutionContext
+
+
+def execute_with_retry(context: AssetExecutionContext, conn: duckdb.DuckDBPyConnection, query: str, parameters=None, retries: int = 5, delay: int = 1):
+    """
+    Executes a SQL query on an open DuckDB connection, retrying the statement
+    when DuckDB raises an IO error (e.g. the database file is locked by another process).
+
+    Args:
+        context (AssetExecutionContext): The asset execution context used for logging.
+        conn (duckdb.DuckDBPyConnection): The open DuckDB connection to execute the query on.
+        query (str): The SQL query to execute.
+        parameters (list | dict, optional): Parameters bound to the query's placeholders.
+        retries (int): The number of attempts before the error is raised.
+        delay (int): Delay between retries in seconds.
+
+    Returns:
+        duckdb.DuckDBPyConnection: The connection holding the query's result.
+    """
+    
+    for attempt in range(retries):
+        try:
+            return conn.execute(query, parameters)
+        except duckdb.IOException as e:
+            if attempt < retries - 1:
+                context.log.warning(f"Retrying due to error: {e}")
+                time.sleep(delay)
+            else:
+                context.log.error("Retries exhausted. Raising error.")
+                raise
+        except Exception as e:
+            context.log.error(f"An unexpected error occurred: {e}")
+            raise
@@ -0,0 +1,49 @@
+# SQL statements creating every table, sequence, and index used by the pipeline's assets.
+# They are all idempotent, so the schema is created on first use and left untouched afterwards
+SCHEMA_SQL = """
+-- Table of the fetched Reddit posts and their humanoid classification labels
+CREATE TABLE IF NOT EXISTS posts (
+    post_id TEXT PRIMARY KEY,
+    humanoid TEXT DEFAULT NULL,
+    subreddit TEXT,
+    title TEXT,
+    created_utc BIGINT,
+    created_local TEXT,
+    score INTEGER,
+    n_comments INTEGER,
+    partition_date VARCHAR(10)
+);
+
+-- Index on the `posts` timestamps every partition is filtered on. `humanoid` is not indexed,
+-- since it is rewritten for every post by the classification UPDATE
+CREATE INDEX IF NOT EXISTS idx_posts_created_utc ON posts (created_utc);
+DROP INDEX IF EXISTS idx_posts_humanoid;  -- Created by earlier versions of the schema
+
+-- Table of the robot-related posts, with the same columns as `posts`
+CREATE TABLE IF NOT EXISTS robot_posts AS
+SELECT * FROM posts WHERE 0=1;
+
+-- Index on the `robot_posts` timestamps each partition is deleted and selected by
+CREATE INDEX IF NOT EXISTS idx_robot_posts_created_utc ON robot_posts (created_utc);
+
+-- Sequence for generating unique IDs of the weekly metrics
+CREATE SEQUENCE IF NOT EXISTS seq_weekly_id START 1;
+
+-- Table of the weekly post metrics of each humanoid category
+CREATE TABLE IF NOT EXISTS weekly_post_metrics (
+    id INTEGER PRIMARY KEY,
+    humanoid TEXT,
+    n_posts INTEGER,
+    avg_score DOUBLE,
+    avg_comments DOUBLE,
+    partition_date VARCHAR(10)
+);
+
+-- Unique key used to upsert each humanoid's weekly metrics
+CREATE UNIQUE INDEX IF NOT EXISTS idx_weekly_post_metrics_humanoid_partition_date
+ON weekly_post_metrics (humanoid, partition_date);
+
+-- Index on the `partition_date` each week's metrics are selected by
+CREATE INDEX IF NOT EXISTS idx_weekly_post_metrics_partition_date
+ON weekly_post_metrics (partition_date);
+"""
@@ -1,11 +1,11 @@
 from dagster import EnvVar
-from dagster_duckdb import DuckDBResource
 from dagster_openai import OpenAIResource
 
+from .duckdb_resource import SchemaDuckDBResource
 from .praw_resource import PRAWResource
 
 
-database_resource = DuckDBResource(
+database_resource = SchemaDuckDBResource(
     database=EnvVar("DUCKDB_DATABASE")
 )
 
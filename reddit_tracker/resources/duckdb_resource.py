@@ -0,0 +1,15 @@
+from dagster import InitResourceContext
+from dagster_duckdb import DuckDBResource
+
+from ..db.schema import SCHEMA_SQL
+
+
+class SchemaDuckDBResource(DuckDBResource):
+    """
+    A DuckDB resource that creates the pipeline's schema once when the resource
+    is initialized, so assets only run their SELECT/INSERT/UPDATE statements.
+    """
+
+    def setup_for_execution(self, context: InitResourceContext) -> None:
+        with self.get_connection() as conn:
+            conn.execute(SCHEMA_SQL)
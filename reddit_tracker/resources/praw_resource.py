@@ -1,4 +1,7 @@
-from dagster import EnvVar, ConfigurableResource
+from typing import Optional
+
+from dagster import EnvVar, ConfigurableResource, InitResourceContext
+from pydantic import PrivateAttr
 import praw
 
 class PRAWResource(ConfigurableResource):
@@ -6,9 +9,16 @@ class PRAWResource(ConfigurableResource):
     client_secret: str
     user_agent: str
 
-    def get_client(self):
-        return praw.Reddit(
+    # Reddit client created once when the resource is initialized, so every call
+    # to `get_client` reuses the same authenticated session
+    _client: Optional[praw.Reddit] = PrivateAttr(default=None)
+
+    def setup_for_execution(self, context: InitResourceContext) -> None:
+        self._client = praw.Reddit(
             client_id=self.client_id,
             client_secret=self.client_secret,
             user_agent=self.user_agent,
         )
+
+    def get_client(self):
+        return self._client
\ No newline at end of file
@@ -1,5 +1,7 @@
 import os
-import json
+import hashlib
+
+import orjson
 
 from dagster import RunRequest, SensorResult, sensor, SensorEvaluationContext
 
@@ -16,7 +18,7 @@ def generate_pdf_reports_sensor(context: SensorEvaluationContext):
 
     This sensor works by:
     1. Monitoring a specified directory for JSON files.
-    2. Checking if a file is new or has been modified since the last run.
+    2. Checking if a file is new or its content has changed since the last run.
     3. If changes are detected, it queues a run request for the `generate_pdf_reports` asset.
 
     Args:
@@ -31,41 +33,63 @@ def generate_pdf_reports_sensor(context: SensorEvaluationContext):
     PATH_TO_SUMMARIES = os.path.join(os.path.dirname(__file__), "../../", "data/outputs/summaries")
 
     # Load the previous state (cursor) if it exists, otherwise initialize an empty dictionary
-    previous_state = json.loads(context.cursor) if context.cursor else {}
+    previous_state = orjson.loads(context.cursor) if context.cursor else {}
     current_state = {}
     
     runs_to_request = []  # List to hold RunRequest objects
 
-     # Iterate through all files in the summaries directory
-    for filename in os.listdir(PATH_TO_SUMMARIES):
-        file_path = os.path.join(PATH_TO_SUMMARIES, filename)
-        if filename.endswith(".json") and os.path.isfile(file_path):
-            last_modified = os.path.getmtime(file_path)  # Get the last modified time of the file
+    # Iterate through all files in the summaries directory, reusing the file type and
+    # stat results of each directory entry instead of querying them per file
+    with os.scandir(PATH_TO_SUMMARIES) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".json") or not entry.is_file():
+                continue
+            
+            filename = entry.name
+            last_modified = entry.stat().st_mtime  # Get the last modified time of the file
+            
+            # Get the file's state from the last run, where cursors written before
+            # content hashes were tracked only store the last modified time
+            previous_file_state = previous_state.get(filename)
+            if not isinstance(previous_file_state, dict):
+                previous_file_state = {"mtime": previous_file_state, "hash": None}
 
-            current_state[filename] = last_modified  # Update the current state
+            # Skip files that are unchanged since the last run without reading them
+            if previous_file_state["mtime"] == last_modified:
+                current_state[filename] = previous_file_state
+                continue
+            
+            # Hash the content of the modified file
+            with open(entry.path, "rb") as f:
+                file_data = f.read()
+            file_hash = hashlib.blake2b(file_data).hexdigest()
 
-            # If the file is new or modified since the last run, queue it for processing
-            if filename not in previous_state or previous_state[filename] != last_modified:
-                with open(file_path, "r") as f:
-                    summaries_json = json.load(f)  # Load the JSON content of the file
+            current_state[filename] = {"mtime": last_modified, "hash": file_hash}  # Update the current state
+            
+            # Skip files whose modified time changed without a change to their content (ie. copied or restored)
+            if previous_file_state["hash"] == file_hash:
+                continue
+            
+            # The file is new or its content changed since the last run, so queue it for processing
+            summaries_json = orjson.loads(file_data)  # Load the JSON content of the file
 
-                    # Create a RunRequest for the `generate_pdf_reports` asset
-                    runs_to_request.append(RunRequest(
-                        run_key=f"generate_pdf_reports_{filename}_{last_modified}",  # Unique identifier for this run
-                        run_config={
-                            "ops": {  # ops is the standard key used in run_config to configure either an operation (op) or an asset in Dagster
-                                "generate_pdf_reports": { # Configuration for the `generate_pdf_reports` asset
-                                    "config": {
-                                        "filename": filename,  # Pass the filename to the asset
-                                        "summaries": summaries_json,  # Pass the JSON content to the asset
-                                    }
-                                }
+            # Create a RunRequest for the `generate_pdf_reports` asset
+            runs_to_request.append(RunRequest(
+                run_key=f"generate_pdf_reports_{filename}_{last_modified}",  # Unique identifier for this run, since content can change back to an earlier hash
+                run_config={
+                    "ops": {  # ops is the standard key used in run_config to configure either an operation (op) or an asset in Dagster
+                        "generate_pdf_reports": { # Configuration for the `generate_pdf_reports` asset
+                            "config": {
+                                "filename": filename,  # Pass the filename to the asset
+                                "summaries": summaries_json,  # Pass the JSON content to the asset
                             }
                         }
-                    ))
+                    }
+                }
+            ))
     
     # Return the run requests along with the updated cursor state
     return SensorResult(
         run_requests=runs_to_request,  # List of RunRequest objects
-        cursor=json.dumps(current_state)   # Serialize the current state to JSON
+        cursor=orjson.dumps(current_state).decode()   # Serialize the current state to JSON
     )
\ No newline at end of file
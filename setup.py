@@ -9,6 +9,8 @@ setup(
         "dagster-duckdb",
         "dagster-openai",
         "pandas",
+        "orjson",
+        "pyarrow",
         "praw",
         "matplotlib",
         "reportlab"